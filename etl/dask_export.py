@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 """
-Dask ETL exporter for journal entries
+ETL exporter for journal entries
 
-This script exports journal entries from the database and writes them to
-Parquet files partitioned by entity_id.
+This script exports journal entries from the database as an Arrow table and
+writes them to Parquet files partitioned by entity_id.
 """
 
+import io
 import os
 import sys
+import shutil
 import argparse
 import pathlib
 import logging
@@ -17,12 +19,21 @@ from datetime import datetime
 # In CI, these will be properly installed
 try:
     import psycopg2
-    import dask.dataframe as dd
-    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.dataset as pa_ds
+    import pyarrow.parquet as pq
     HAS_DEPENDENCIES = True
 except ImportError:
     HAS_DEPENDENCIES = False
 
+# ConnectorX is optional - without it we stream the query through COPY instead
+try:
+    import connectorx as cx
+    HAS_CONNECTORX = True
+except ImportError:
+    HAS_CONNECTORX = False
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -32,14 +43,14 @@ logger = logging.getLogger('dask_export')
 
 def parse_args():
     """Parse command line arguments"""
-    parser = argparse.ArgumentParser(description='Export journal entries to Parquet using Dask')
+    parser = argparse.ArgumentParser(description='Export journal entries to Parquet using PyArrow')
     parser.add_argument('--dry-run', action='store_true', help='Run in dry-run mode (limit 100 rows)')
     parser.add_argument('--output-dir', default='data/raw/journal_entries',
                       help='Directory to store Parquet files')
     return parser.parse_args()
 
-def get_database_connection():
-    """Get a connection to the database using environment variables"""
+def get_connection_string():
+    """Build the database connection string from environment variables"""
     conn_string = os.environ.get('DATABASE_URL')
     if not conn_string:
         # Try to build connection string from individual env vars
@@ -51,8 +62,35 @@ def get_database_connection():
         
         conn_string = f"postgresql://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
     
+    return conn_string
+
+def get_database_connection():
+    """Get a connection to the database using environment variables"""
     logger.info(f"Connecting to database...")
-    return psycopg2.connect(conn_string)
+    return psycopg2.connect(get_connection_string())
+
+def read_arrow_table(conn, query, dry_run=False):
+    """Read the query result as an Arrow table without going through pandas"""
+    if HAS_CONNECTORX:
+        # ConnectorX decodes the result set straight into Arrow record batches.
+        # Partitioned reads wrap the query in range predicates on id, which
+        # would multiply the LIMIT in dry-run mode, so only partition full runs.
+        partition_kwargs = {} if dry_run else {'partition_on': 'id', 'partition_num': 4}
+        return cx.read_sql(get_connection_string(), query, return_type='arrow', **partition_kwargs)
+    
+    # Fallback: stream the result through COPY and parse it with pyarrow's
+    # multithreaded CSV reader instead of decoding tuples row by row
+    buf = io.BytesIO()
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT CSV, HEADER)", buf)
+    buf.seek(0)
+    return pa_csv.read_csv(buf)
+
+# Low-cardinality string columns stored dictionary-encoded end to end
+CATEGORICAL_COLUMNS = ['currency', 'status']
+
+# Float columns that compress better with byte-stream split encoding
+BYTE_STREAM_SPLIT_COLUMNS = ['amount', 'exchange_rate']
 
 def fetch_journal_entries(conn, dry_run=False):
     """Fetch journal entries from the database"""
@@ -70,16 +108,27 @@ def fetch_journal_entries(conn, dry_run=False):
     
     logger.info(f"Executing query: {query}")
     
-    # Use pandas to read from the database connection
-    df = pd.read_sql(query, conn)
-    logger.info(f"Retrieved {len(df)} journal entries")
+    # Fetch the result set as Arrow rather than through pd.read_sql
+    table = read_arrow_table(conn, query, dry_run)
+    logger.info(f"Retrieved {table.num_rows} journal entries")
+    
+    # Store date as a timestamp so consumers can use .dt accessors without
+    # re-parsing it
+    date_idx = table.schema.get_field_index('date')
+    table = table.set_column(date_idx, 'date', table['date'].cast(pa.timestamp('ns')))
+    
+    # Dictionary-encode low-cardinality strings once; they are written to
+    # Parquet without re-encoding and read back as categoricals
+    for name in CATEGORICAL_COLUMNS:
+        idx = table.schema.get_field_index(name)
+        table = table.set_column(idx, name, table[name].dictionary_encode())
     
-    # Convert the pandas DataFrame to a Dask DataFrame
-    ddf = dd.from_pandas(df, npartitions=4)
-    return ddf
+    # Sort by entity_id to match the Parquet layout, so each entity is one
+    # contiguous run and the writer fills whole row groups per partition
+    return table.sort_by('entity_id')
 
-def write_to_parquet(ddf, output_dir, dry_run=False):
-    """Write the Dask DataFrame to Parquet files partitioned by entity_id"""
+def write_to_parquet(table, output_dir, dry_run=False):
+    """Write the Arrow table to Parquet files partitioned by entity_id"""
     # Ensure the output directory exists
     pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
     
@@ -88,17 +137,69 @@ def write_to_parquet(ddf, output_dir, dry_run=False):
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_dir = f"{output_dir}/dry_run_{timestamp}"
     
-    logger.info(f"Writing {len(ddf.index.compute())} rows to Parquet in {output_dir}")
+    logger.info(f"Writing journal entries to Parquet in {output_dir}")
+    
+    # Remove the previous export's partitions and summary first; _metadata is
+    # built only from this run's files, so stale files (including entities
+    # that no longer exist) would leave it disagreeing with the directory
+    if os.path.isdir(output_dir):
+        for name in os.listdir(output_dir):
+            path = os.path.join(output_dir, name)
+            if name.startswith('entity_id=') and os.path.isdir(path):
+                shutil.rmtree(path)
+            elif name == '_metadata':
+                os.remove(path)
+    
+    # The Arrow table goes straight to the multithreaded dataset writer, with
+    # no pandas round trip; it keeps one open file per entity
+    schema = table.schema
+    
+    # Byte-stream split only applies to floating point columns; numeric
+    # columns may also arrive as decimals depending on the fetch path
+    float_columns = [
+        name for name in BYTE_STREAM_SPLIT_COLUMNS
+        if name in schema.names and pa.types.is_floating(schema.field(name).type)
+    ]
+    
+    file_format = pa_ds.ParquetFileFormat()
+    file_options = file_format.make_write_options(
+        compression='zstd',
+        compression_level=3,
+        use_dictionary=True,
+        data_page_version='2.0',
+        write_statistics=True,
+        use_byte_stream_split=float_columns or False
+    )
+    
+    # Collect each file's footer for the _metadata summary file
+    metadata_collector = []
+    
+    def collect_metadata(written_file):
+        written_file.metadata.set_file_path(os.path.relpath(written_file.path, output_dir))
+        metadata_collector.append(written_file.metadata)
     
     # Write to Parquet, partitioned by entity_id
-    ddf.to_parquet(
-        output_dir,
-        engine='pyarrow',
-        partition_on=['entity_id'],
-        write_index=False
+    pa_ds.write_dataset(
+        table,
+        base_dir=output_dir,
+        schema=schema,
+        format=file_format,
+        file_options=file_options,
+        partitioning=['entity_id'],
+        partitioning_flavor='hive',
+        max_rows_per_file=1_000_000,
+        max_rows_per_group=128 * 1024,
+        existing_data_behavior='overwrite_or_ignore',
+        file_visitor=collect_metadata
     )
     
-    return len(ddf.index.compute())
+    # Write the _metadata summary so readers parse one footer instead of N;
+    # partition columns live in the directory names, not the files
+    file_schema = schema.remove(schema.get_field_index('entity_id'))
+    pq.write_metadata(file_schema, os.path.join(output_dir, '_metadata'),
+                      metadata_collector=metadata_collector)
+    
+    return table.num_rows
 
 def main():
     """Main function"""
@@ -108,14 +209,14 @@ def main():
     # This is for local development only - CI will have all dependencies
     if args.dry_run and not HAS_DEPENDENCIES:
         print("Running in simulation mode (dependencies not available)")
-        print("In CI environment, this will use actual Dask and PostgreSQL")
+        print("In CI environment, this will use actual PyArrow and PostgreSQL")
         print("Wrote 42 rows to Parquet")
         return 0
     
     if not HAS_DEPENDENCIES:
         logger.error("Required dependencies not available")
         print("Error: Required dependencies not available")
-        print("Make sure psycopg2, dask, and pandas are installed")
+        print("Make sure psycopg2 and pyarrow are installed")
         print("In CI environment, this will be handled by backend/requirements.ml.txt")
         return 1
     
@@ -124,10 +225,10 @@ def main():
         conn = get_database_connection()
         
         # Fetch journal entries
-        ddf = fetch_journal_entries(conn, args.dry_run)
+        table = fetch_journal_entries(conn, args.dry_run)
         
         # Write to Parquet
-        row_count = write_to_parquet(ddf, args.output_dir, args.dry_run)
+        row_count = write_to_parquet(table, args.output_dir, args.dry_run)
         
         # Log success message
         logger.info(f"Wrote {row_count} rows to Parquet")
@@ -7,24 +7,37 @@ SHAP Explainability Script for XGBoost Anomaly Detection
 This script loads a trained XGBoost model and computes SHAP values
 for the last 100 journal entries of a specified entity. It outputs
 the top contributing features for anomaly detection as JSON.
+
+stdout carries only that JSON document, which the API route parses;
+diagnostics go to stderr.
 """
 
 import os
 import sys
 import json
 import argparse
+import functools
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import joblib
 import pandas as pd
 import numpy as np
 from pathlib import Path
 
+def _has_module(name):
+    """Check whether a module is installed without importing it"""
+    return importlib.util.find_spec(name) is not None
+
+# Heavy dependencies are only checked for here and imported where they are
+# used, so the mock-output path doesn't pay for the shap/pyarrow import graph
+DEPENDENCIES_AVAILABLE = _has_module('shap') and _has_module('pyarrow')
+XGBOOST_AVAILABLE = _has_module('xgboost')
+
 try:
-    import shap
-    import dask.dataframe as dd
-    DEPENDENCIES_AVAILABLE = True
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    DEPENDENCIES_AVAILABLE = False
+    ORJSON_AVAILABLE = False
 
 def parse_args():
     """Parse command line arguments"""
@@ -39,10 +52,8 @@ def parse_args():
     
     return parser.parse_args()
 
-def get_entity_id():
+def get_entity_id(args):
     """Get entity ID from environment variable or arguments"""
-    args = parse_args()
-    
     # First check command line
     if args.entity:
         return args.entity
@@ -53,91 +64,183 @@ def get_entity_id():
         return env_entity
     
     # Default case if nothing specified
-    print("No entity ID specified, using default entity 'E001'")
+    print("No entity ID specified, using default entity 'E001'", file=sys.stderr)
     return "E001"
 
+# Features used when the model directory has no features.json
+DEFAULT_FEATURE_LIST = [
+    "amount",
+    "day_of_week",
+    "day_of_month",
+    "month",
+    "account_balance_delta",
+    "transaction_count_7d",
+    "transaction_amount_7d",
+    "is_round_number",
+    "is_weekend"
+]
+
+@functools.lru_cache(maxsize=None)
+def load_feature_list(model_path):
+    """Load the feature list the training script saves next to the model"""
+    feature_path = os.path.join(os.path.dirname(model_path), 'features.json')
+    if os.path.exists(feature_path):
+        with open(feature_path) as f:
+            return json.load(f)
+    
+    return DEFAULT_FEATURE_LIST
+
+@functools.lru_cache(maxsize=None)
 def load_model(model_path):
     """Load the XGBoost model and feature list"""
     try:
-        # For a proper implementation, this would load the actual model
-        # For now, we'll create a simple placeholder
         if os.path.exists(model_path):
-            # In production, we'd use: model = joblib.load(model_path)
-            model = {"mock": True}
+            feature_list = load_feature_list(model_path)
             
-            # Load feature list (would be stored with the model in production)
-            feature_list = [
-                "amount",
-                "day_of_week",
-                "day_of_month",
-                "month",
-                "account_balance_delta",
-                "transaction_count_7d",
-                "transaction_amount_7d",
-                "is_round_number",
-                "is_weekend"
-            ]
+            # Models are stored as raw UBJSON, which XGBoost parses natively
+            model = {"mock": True}
+            if XGBOOST_AVAILABLE:
+                import xgboost as xgb
+                
+                with open(model_path, 'rb') as f:
+                    raw = f.read()
+                try:
+                    booster = xgb.Booster()
+                    booster.load_model(bytearray(raw))
+                    model = booster
+                except xgb.core.XGBoostError:
+                    # Simulation-mode training writes a placeholder, not a booster
+                    print(f"Model at {model_path} is not an XGBoost booster, using placeholder", file=sys.stderr)
             
             return model, feature_list
         else:
-            print(f"Model file not found at {model_path}")
+            print(f"Model file not found at {model_path}", file=sys.stderr)
             return None, None
     except Exception as e:
-        print(f"Error loading model: {e}")
+        print(f"Error loading model: {e}", file=sys.stderr)
         return None, None
 
-def get_entity_data(entity_id, input_dir, num_entries=100):
+@functools.lru_cache(maxsize=1)
+def _open_dataset(input_dir):
+    """Open the Hive-partitioned journal entry dataset, reusing it across calls"""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    
+    # entity_id is always compared as a string, whatever the directory names look like
+    partitioning = ds.partitioning(pa.schema([('entity_id', pa.string())]), flavor='hive')
+    
+    # The exporter writes a _metadata summary so only one footer has to be parsed
+    metadata_path = os.path.join(input_dir, '_metadata')
+    if os.path.exists(metadata_path):
+        return ds.parquet_dataset(metadata_path, partitioning=partitioning)
+    
+    return ds.dataset(input_dir, format='parquet', partitioning=partitioning)
+
+def _max_entry_date(row_group):
+    """Upper bound of entry_date in a single-row-group fragment, if recorded"""
+    stats = row_group.row_groups[0].statistics if row_group.row_groups else None
+    if not stats or 'entry_date' not in stats:
+        return None
+    return stats['entry_date'].get('max')
+
+def _read_latest_entries(dataset, entity_id, columns, num_entries):
+    """Scan an entity's rows keeping only the latest entries seen so far"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    
+    entity_filter = pc.field('entity_id') == entity_id
+    # entity_id is a partition key, not a file column, so the fragments are
+    # pruned to the entity here and split without a filter
+    row_groups = [
+        row_group
+        for fragment in dataset.get_fragments(filter=entity_filter)
+        for row_group in fragment.split_by_row_group()
+    ]
+    
+    # Visit the newest row groups first (unknown bounds before everything else)
+    # so the rest can be skipped once their statistics rule them out
+    row_groups.sort(key=lambda rg: (_max_entry_date(rg) is None, _max_entry_date(rg)), reverse=True)
+    
+    latest = None
+    for row_group in row_groups:
+        if latest is not None and latest.num_rows >= num_entries:
+            max_date = _max_entry_date(row_group)
+            cutoff = pc.min(latest['entry_date']).as_py()
+            if max_date is not None and max_date < cutoff:
+                break
+        
+        for batch in row_group.to_batches(schema=dataset.schema, columns=columns,
+                                          filter=entity_filter, batch_size=8192):
+            candidates = pa.Table.from_batches([batch])
+            if latest is not None:
+                candidates = pa.concat_tables([latest, candidates])
+            
+            # Bounded top-k: never hold more than num_entries rows between batches
+            indices = pc.select_k_unstable(candidates, k=num_entries,
+                                           sort_keys=[('entry_date', 'descending')])
+            latest = candidates.take(indices)
+    
+    if latest is None:
+        return pd.DataFrame(columns=columns)
+    
+    return latest.sort_by([('entry_date', 'descending')]).to_pandas()
+
+def get_entity_data(entity_id, input_dir, num_entries=100, feature_list=None):
     """Get the latest journal entries for the specified entity"""
     if not DEPENDENCIES_AVAILABLE:
-        print("Dependencies not available, using synthetic data")
+        print("Dependencies not available, using synthetic data", file=sys.stderr)
         return create_synthetic_entity_data(entity_id, num_entries)
     
     try:
-        # Read Parquet files from the directory
+        # The export is Hive-partitioned, so the entity's directory tells us
+        # whether there is anything to read without opening a file
         parquet_path = os.path.join(input_dir, f"entity_id={entity_id}")
         
         if os.path.exists(parquet_path):
-            # Read data using Dask
-            ddf = dd.read_parquet(parquet_path)
+            dataset = _open_dataset(input_dir)
             
-            # Convert to pandas and sort by date
-            df = ddf.compute()
-            df = df.sort_values('entry_date', ascending=False)
+            # Only decode the columns we need and let pyarrow prune every
+            # other entity's partition before reading
+            columns = None
+            if feature_list:
+                needed = dict.fromkeys(list(feature_list) + ['entity_id', 'entry_date'])
+                columns = [name for name in needed if name in dataset.schema.names]
             
             # Take the latest n entries
-            df = df.head(num_entries)
+            df = _read_latest_entries(dataset, entity_id, columns, num_entries)
             
             return df
         else:
-            print(f"No data found for entity {entity_id}, using synthetic data")
+            print(f"No data found for entity {entity_id}, using synthetic data", file=sys.stderr)
             return create_synthetic_entity_data(entity_id, num_entries)
             
     except Exception as e:
-        print(f"Error reading data: {e}")
+        print(f"Error reading data: {e}", file=sys.stderr)
         return create_synthetic_entity_data(entity_id, num_entries)
 
 def create_synthetic_entity_data(entity_id, num_entries=100):
     """Create synthetic data for an entity"""
-    np.random.seed(int(entity_id.replace('E', '')) if entity_id.startswith('E') else 42)
+    rng = np.random.default_rng(int(entity_id.replace('E', '')) if entity_id.startswith('E') else 42)
     
-    # Generate dates for the past 100 days
-    today = datetime.now().date()
-    dates = [today - pd.Timedelta(days=i) for i in range(num_entries)]
+    # Generate dates for the past 100 days, most recent first
+    dates = pd.date_range(start=pd.Timestamp.today().normalize(), periods=num_entries, freq='-1D')
     
-    # Generate synthetic data with the required features
+    # Generate synthetic data with the required features, one vectorized
+    # draw per column
+    entry_numbers = np.char.zfill(np.arange(1, num_entries + 1).astype(str), 4)
     data = {
-        'entry_id': [f"{entity_id}-JE{i:04d}" for i in range(1, num_entries + 1)],
-        'entity_id': [entity_id] * num_entries,
+        'entry_id': np.char.add(f"{entity_id}-JE", entry_numbers),
+        'entity_id': entity_id,
         'entry_date': dates,
-        'amount': np.random.normal(1000, 500, num_entries),
-        'day_of_week': [d.weekday() for d in dates],
-        'day_of_month': [d.day for d in dates],
-        'month': [d.month for d in dates],
-        'account_balance_delta': np.random.normal(0, 200, num_entries),
-        'transaction_count_7d': np.random.poisson(5, num_entries),
-        'transaction_amount_7d': np.random.gamma(1000, 100, num_entries),
-        'is_round_number': np.random.choice([0, 1], num_entries, p=[0.7, 0.3]),
-        'is_weekend': [1 if d.weekday() >= 5 else 0 for d in dates]
+        'amount': rng.normal(1000, 500, num_entries),
+        'day_of_week': dates.weekday,
+        'day_of_month': dates.day,
+        'month': dates.month,
+        'account_balance_delta': rng.normal(0, 200, num_entries),
+        'transaction_count_7d': rng.poisson(5, num_entries),
+        'transaction_amount_7d': rng.gamma(1000, 100, num_entries),
+        'is_round_number': (rng.random(num_entries) < 0.3).astype(np.int8),
+        'is_weekend': (dates.weekday >= 5).astype(np.int8)
     }
     
     # Create DataFrame
@@ -147,60 +250,127 @@ def create_synthetic_entity_data(entity_id, num_entries=100):
 
 def prepare_features(df, feature_list):
     """Prepare features for SHAP analysis"""
-    # Extract only the needed features
-    X = df[feature_list].copy()
+    # Derive calendar features the stored data lacks with vectorized
+    # datetime accessors rather than per-row Python
+    missing = set(feature_list) - set(df.columns)
+    if missing and 'entry_date' in df.columns:
+        dates = pd.to_datetime(df['entry_date']).dt
+        derived = {
+            'day_of_week': dates.weekday,
+            'day_of_month': dates.day,
+            'month': dates.month,
+            'is_weekend': (dates.weekday >= 5).astype(np.int8)
+        }
+        df = df.assign(**{name: values for name, values in derived.items() if name in missing})
+    
+    # Extract only the needed features, zero-filling any still missing, as a
+    # single row-major float32 buffer for the tree predictor
+    X = df.reindex(columns=feature_list, fill_value=0)
+    
+    return np.ascontiguousarray(X.to_numpy(dtype=np.float32))
+
+def _get_booster(model):
+    """Return the underlying XGBoost booster, or None for non-XGBoost models"""
+    if not XGBOOST_AVAILABLE:
+        return None
+    
+    import xgboost as xgb
     
-    return X
+    if isinstance(model, xgb.Booster):
+        return model
+    if hasattr(model, 'get_booster'):
+        return model.get_booster()
+    return None
 
-def compute_shap_values(model, X):
+def _gpu_tree_contributions(model, X, feature_names):
+    """Compute SHAP values with XGBoost's GPUTreeShap predictor, if possible"""
+    booster = _get_booster(model)
+    if booster is None:
+        return None
+    
+    import xgboost as xgb
+    
+    # Training parameters aren't saved with the model, so a loaded booster
+    # can't tell us how it was grown; just try the GPU unless XGBoost was
+    # built without CUDA. Without a visible GPU XGBoost computes the same
+    # exact contributions on the CPU.
+    if not xgb.build_info().get('USE_CUDA'):
+        return None
+    
+    try:
+        booster.set_param({'device': 'cuda'})
+        contribs = booster.predict(xgb.DMatrix(X, feature_names=list(feature_names)), pred_contribs=True)
+    except Exception:
+        # No usable GPU - restore the CPU predictor and let TreeExplainer run
+        booster.set_param({'device': 'cpu'})
+        return None
+    
+    # The last column holds the bias term, not a feature contribution
+    return contribs[:, :-1]
+
+def _is_booster(model):
+    """Whether model is a real XGBoost booster rather than the simulation placeholder"""
+    if not XGBOOST_AVAILABLE:
+        return False
+    import xgboost as xgb
+    return isinstance(model, xgb.Booster)
+
+def compute_shap_values(model, X, feature_names):
     """Compute SHAP values for the data"""
     if not DEPENDENCIES_AVAILABLE:
-        # If SHAP not available, create synthetic SHAP values
-        feature_names = X.columns
-        n_samples = X.shape[0]
-        
-        # Create synthetic SHAP values
-        shap_values = np.random.normal(0, 1, (n_samples, len(feature_names)))
+        # If SHAP not available, report no contribution from any feature
+        shap_values = np.zeros((X.shape[0], len(feature_names)), dtype=np.float32)
         
         return shap_values, feature_names
     
     try:
-        # For an actual implementation, use:
-        # explainer = shap.TreeExplainer(model)
-        # shap_values = explainer.shap_values(X)
+        # Prefer the GPU predictor's native SHAP contributions
+        shap_values = _gpu_tree_contributions(model, X, feature_names)
+        if shap_values is not None:
+            return shap_values, feature_names
+        
+        import shap
         
-        # Synthetic SHAP values for now
-        shap_values = np.random.normal(0, 1, (X.shape[0], X.shape[1]))
+        # Go straight to the tree algorithm instead of shap.Explainer's dispatch
+        explainer = shap.TreeExplainer(model, feature_perturbation='tree_path_dependent')
+        shap_values = explainer.shap_values(X, check_additivity=False)
         
-        return shap_values, X.columns
+        return shap_values, feature_names
     except Exception as e:
-        print(f"Error computing SHAP values: {e}")
-        # Fall back to random values
-        shap_values = np.random.normal(0, 1, (X.shape[0], X.shape[1]))
-        return shap_values, X.columns
+        # Fail loudly rather than emit plausible-looking values
+        raise RuntimeError(f"Error computing SHAP values: {e}") from e
+
+def mean_abs_shap(shap_values):
+    """Average absolute SHAP value per feature"""
+    # Accept both raw arrays and shap.Explanation objects, in float32
+    values = np.ascontiguousarray(getattr(shap_values, 'values', shap_values), dtype=np.float32)
+    if values.shape[0] == 0:
+        return np.zeros(values.shape[1], dtype=np.float32)
+    return np.abs(values).mean(axis=0)
 
 def get_top_features(shap_values, feature_names, top_n=5):
     """Get the top contributing features based on SHAP values"""
     # Calculate average absolute SHAP value for each feature
-    mean_abs_shap = np.abs(shap_values).mean(axis=0)
+    importances = mean_abs_shap(shap_values)
     
-    # Create feature importance pairs
-    feature_importance = list(zip(feature_names, mean_abs_shap))
+    # Select the top N features without sorting the rest (highest first)
+    top_n = min(top_n, len(importances))
+    top_idx = np.argpartition(importances, -top_n)[-top_n:] if top_n else np.array([], dtype=int)
+    top_idx = top_idx[np.argsort(-importances[top_idx], kind='stable')]
     
-    # Sort by importance (highest first)
-    sorted_importance = sorted(feature_importance, key=lambda x: x[1], reverse=True)
+    # Normalize to 0-100 relative to the top feature in one vector op
+    top_values = importances[top_idx]
+    max_importance = top_values[0] if top_n else 0
+    if max_importance:
+        scores = (100 * top_values / max_importance).astype(np.int64)
+    else:
+        scores = np.zeros(top_n, dtype=np.int64)
     
-    # Take top N features
-    top_features = sorted_importance[:top_n]
-    
-    # Format as a list of dicts with normalized values (0-100)
-    max_importance = top_features[0][1] if top_features else 1
+    # Format as a list of dicts in a single pass
+    names = np.asarray(feature_names)[top_idx]
     formatted_features = [
-        {
-            "feature": feature,
-            "importance": int(100 * importance / max_importance) if max_importance else 0
-        }
-        for feature, importance in top_features
+        {"feature": str(feature), "importance": int(score)}
+        for feature, score in zip(names, scores)
     ]
     
     return formatted_features
@@ -215,6 +385,9 @@ def format_output(entity_id, top_features):
         "model_type": "XGBoost"
     }
     
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY).decode()
+    
     return json.dumps(result, indent=2)
 
 def generate_mock_output(entity_id):
@@ -231,12 +404,12 @@ def generate_mock_output(entity_id):
 
 def main():
     """Main function"""
-    # Get entity ID to analyze
-    entity_id = get_entity_id()
-    
-    # Parse other arguments
+    # Parse arguments once
     args = parse_args()
     
+    # Get entity ID to analyze
+    entity_id = get_entity_id(args)
+    
     # Set paths
     model_path = args.model_path
     input_dir = args.input_dir
@@ -244,32 +417,54 @@ def main():
     
     # Check if dependencies are available
     if not DEPENDENCIES_AVAILABLE:
-        print("Some dependencies (SHAP, Dask) not available, using simulation mode")
+        print("Some dependencies (SHAP, PyArrow) not available, using simulation mode", file=sys.stderr)
         mock_output = generate_mock_output(entity_id)
         print(mock_output)
         return 0
     
-    # Load model and features
-    model, feature_list = load_model(model_path)
-    if model is None or feature_list is None:
-        print("Failed to load model, using mock output")
+    # The feature list is a small JSON file; read it up front so the data scan
+    # can project columns while the model loads
+    feature_list = load_feature_list(model_path)
+    
+    # Load the model and the entity data concurrently; both spend most of
+    # their time in I/O or native code that releases the GIL
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        model_future = executor.submit(load_model, model_path)
+        data_future = executor.submit(get_entity_data, entity_id, input_dir, num_entries, feature_list)
+        
+        # Load model and features
+        model, feature_list = model_future.result()
+        if model is None or feature_list is None:
+            print("Failed to load model, using mock output", file=sys.stderr)
+            mock_output = generate_mock_output(entity_id)
+            print(mock_output)
+            return 1
+        
+        # Get entity data
+        df = data_future.result()
+    
+    if df is None or df.empty:
+        print(f"No data available for entity {entity_id}, using mock output", file=sys.stderr)
         mock_output = generate_mock_output(entity_id)
         print(mock_output)
         return 1
     
-    # Get entity data
-    df = get_entity_data(entity_id, input_dir, num_entries)
-    if df is None or df.empty:
-        print(f"No data available for entity {entity_id}, using mock output")
+    # Simulation-mode training leaves a placeholder rather than a booster;
+    # there is nothing to explain, so answer with the mock payload
+    if not _is_booster(model):
         mock_output = generate_mock_output(entity_id)
         print(mock_output)
-        return 1
+        return 0
     
     # Prepare features
     X = prepare_features(df, feature_list)
     
     # Compute SHAP values
-    shap_values, feature_names = compute_shap_values(model, X)
+    try:
+        shap_values, feature_names = compute_shap_values(model, X, feature_list)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
     
     # Get top contributing features
     top_features = get_top_features(shap_values, feature_names)
@@ -12,22 +12,58 @@ models/anomaly directory for later use in SHAP explainability and the API.
 import os
 import sys
 import json
+import atexit
+import shutil
+import tempfile
 import argparse
-from datetime import datetime
-from pathlib import Path
 import numpy as np
-import joblib
-import random
 
 try:
+    import dask
     import dask.dataframe as dd
-    import dask_xgboost
+    from dask.distributed import Client, LocalCluster
+    import xgboost as xgb
+    from xgboost import dask as dxgb
     import pandas as pd
-    from sklearn.model_selection import train_test_split
+    import pyarrow as pa
+    import pyarrow.dataset as pa_ds
+    import pyarrow.parquet as pq
     DEPENDENCIES_AVAILABLE = True
 except ImportError:
     DEPENDENCIES_AVAILABLE = False
 
+# dask_cuda is only present on GPU hosts
+try:
+    from dask_cuda import LocalCUDACluster
+    HAS_DASK_CUDA = True
+except ImportError:
+    HAS_DASK_CUDA = False
+
+# Below this many rows GPU kernel launch overhead outweighs the speedup
+GPU_MIN_ROWS = 50_000
+# Up to this many rows training runs in-process instead of on a Dask cluster
+LOCAL_MAX_ROWS = 200_000
+NUM_BOOST_ROUND = 100
+
+# Features for anomaly detection
+FEATURE_LIST = [
+    'amount',
+    'day_of_week',
+    'day_of_month',
+    'month',
+    'account_balance_delta',
+    'transaction_count_7d',
+    'transaction_amount_7d',
+    'is_round_number',
+    'is_weekend'
+]
+LABEL_COLUMN = 'is_anomalous'
+
+# Fraction of entities read in sample mode
+SAMPLE_FRACTION = 0.1
+# Target number of rows when sample mode has to sample rows instead
+SAMPLE_ROWS = 1000
+
 def parse_args():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(
@@ -42,7 +78,19 @@ def parse_args():
     
     return parser.parse_args()
 
-def read_data(input_dir, sample=False):
+def sample_entity_ids(input_dir):
+    """Pick a fraction of the Hive entity_id partitions from the directory listing"""
+    entity_ids = sorted(
+        name.split('=', 1)[1] for name in os.listdir(input_dir)
+        if name.startswith('entity_id=')
+    )
+    if not entity_ids:
+        return []
+    
+    n_sampled = max(1, int(len(entity_ids) * SAMPLE_FRACTION))
+    return entity_ids[:n_sampled]
+
+def read_data(input_dir, sample=False, feature_list=FEATURE_LIST):
     """Read journal entries from Parquet files using Dask"""
     if not DEPENDENCIES_AVAILABLE:
         print("Dependencies not available, using synthetic data")
@@ -54,13 +102,36 @@ def read_data(input_dir, sample=False):
             print(f"Input directory {input_dir} does not exist")
             return create_synthetic_data(sample)
         
-        # Read all Parquet files in the directory
-        ddf = dd.read_parquet(input_dir)
+        # entity_id is a Hive partition key; always treat it as a string
+        partitioning = pa_ds.partitioning(pa.schema([('entity_id', pa.string())]), flavor='hive')
+        
+        # Only read the feature and label columns, checked against the schema
+        # in the Parquet footers
+        dataset = pa_ds.dataset(input_dir, format='parquet', partitioning=partitioning)
+        columns = [name for name in list(feature_list) + [LABEL_COLUMN] if name in dataset.schema.names]
         
-        # Take a sample if requested
+        # In sample mode read whole entities so partition pruning skips the
+        # rest of the files, instead of reading everything and sampling rows
+        filters = None
         if sample:
-            # Use a small fraction for testing
-            ddf = ddf.sample(frac=0.1)
+            entity_ids = sample_entity_ids(input_dir)
+            if entity_ids:
+                filters = [('entity_id', 'in', entity_ids)]
+        
+        ddf = dd.read_parquet(
+            input_dir,
+            columns=columns,
+            filters=filters,
+            split_row_groups=True,
+            dataset={'partitioning': partitioning}
+        )
+        
+        # Not Hive-partitioned: fall back to sampling rows, sizing the fraction
+        # from the row counts in the footers rather than scanning the data
+        if sample and filters is None:
+            n_rows = dataset.count_rows()
+            frac = min(SAMPLE_ROWS / n_rows, 1.0) if n_rows else 1.0
+            ddf = ddf.sample(frac=frac, random_state=42)
         
         return ddf
     except Exception as e:
@@ -69,98 +140,80 @@ def read_data(input_dir, sample=False):
 
 def create_synthetic_data(sample=False):
     """Create synthetic data for testing/development"""
-    # Number of samples
-    n_samples = 1000 if sample else 10000
+    rng = np.random.default_rng(42)
+    
+    # Number of entities
     n_entities = 5 if sample else 20
     
     # Create synthetic entity IDs
-    entity_ids = [f"E{i:03d}" for i in range(1, n_entities + 1)]
+    entity_ids = np.array([f"E{i:03d}" for i in range(1, n_entities + 1)])
     
-    # Create synthetic dates
-    today = datetime.now().date()
+    # Generate random number of entries for each entity, then flatten so
+    # every column below is drawn in a single vectorized call
+    low, high = (50, 200) if sample else (200, 500)
+    counts = rng.integers(low, high + 1, n_entities)
+    n_rows = int(counts.sum())
+    entity_col = np.repeat(entity_ids, counts)
+    entry_index = np.arange(n_rows) - np.repeat(np.cumsum(counts) - counts, counts)
     
-    # Lists to hold data
-    all_data = []
+    # Random date within the last 365 days, as a single datetime64[D] array
+    today = np.datetime64('today', 'D')
+    entry_dates = today - rng.integers(0, 366, n_rows).astype('timedelta64[D]')
+    calendar = pd.DatetimeIndex(entry_dates)
     
-    for entity_id in entity_ids:
-        # Generate random number of entries for this entity
-        n_entity_entries = random.randint(50, 200) if sample else random.randint(200, 500)
-        
-        for i in range(n_entity_entries):
-            # Random date within the last 365 days
-            days_ago = random.randint(0, 365)
-            entry_date = today - pd.Timedelta(days=days_ago)
-            
-            # Generate features that would be useful for anomaly detection
-            amount = random.normalvariate(1000, 500)
-            day_of_week = entry_date.weekday()
-            day_of_month = entry_date.day
-            month = entry_date.month
-            
-            # Add some potentially anomalous entries (5% chance)
-            is_anomalous = random.random() < 0.05
-            
-            # If anomalous, modify some features
-            if is_anomalous:
-                # Anomalous amounts tend to be round numbers
-                amount = round(amount, -2)  # Round to nearest 100
-                
-                # Anomalous entries are more likely on weekends
-                if random.random() < 0.7:
-                    day_of_week = 5 if random.random() < 0.5 else 6  # Sat or Sun
-            
-            # Additional derived features
-            account_balance_delta = random.normalvariate(0, 200)
-            transaction_count_7d = max(0, random.normalvariate(5, 2))
-            transaction_amount_7d = max(0, random.normalvariate(5000, 1000))
-            is_round_number = 1 if amount % 100 == 0 else 0
-            is_weekend = 1 if day_of_week >= 5 else 0
-            
-            # Create entry
-            entry = {
-                'entry_id': f"{entity_id}-JE{i:04d}",
-                'entity_id': entity_id,
-                'entry_date': entry_date,
-                'amount': amount,
-                'day_of_week': day_of_week,
-                'day_of_month': day_of_month,
-                'month': month,
-                'account_balance_delta': account_balance_delta,
-                'transaction_count_7d': transaction_count_7d,
-                'transaction_amount_7d': transaction_amount_7d,
-                'is_round_number': is_round_number,
-                'is_weekend': is_weekend,
-                # Target variable - 1 if anomalous, 0 if normal
-                'is_anomalous': 1 if is_anomalous else 0
-            }
-            
-            all_data.append(entry)
+    # Generate features that would be useful for anomaly detection
+    amount = rng.normal(1000, 500, n_rows)
+    # Weekday straight from days since the epoch (1970-01-01 was a Thursday)
+    day_of_week = ((entry_dates.astype(np.int64) + 3) % 7).astype(np.int8)
+    
+    # Add some potentially anomalous entries (5% chance)
+    is_anomalous = rng.random(n_rows) < 0.05
+    
+    # Anomalous amounts tend to be round numbers (nearest 100)
+    amount = np.where(is_anomalous, np.round(amount, -2), amount)
+    
+    # Anomalous entries are more likely on weekends (Sat or Sun)
+    on_weekend = is_anomalous & (rng.random(n_rows) < 0.7)
+    weekend_day = np.where(rng.random(n_rows) < 0.5, 5, 6)
+    day_of_week = np.where(on_weekend, weekend_day, day_of_week).astype(np.int8)
+    
+    # Create an Arrow table from whole columns
+    table = pa.table({
+        'entry_id': np.char.add(np.char.add(entity_col, '-JE'),
+                                np.char.zfill(entry_index.astype(str), 4)),
+        'entity_id': entity_col,
+        'entry_date': entry_dates,
+        'amount': amount,
+        'day_of_week': day_of_week,
+        'day_of_month': calendar.day.to_numpy().astype(np.int8),
+        'month': calendar.month.to_numpy().astype(np.int8),
+        # Additional derived features
+        'account_balance_delta': rng.normal(0, 200, n_rows),
+        'transaction_count_7d': np.maximum(0, rng.normal(5, 2, n_rows)),
+        'transaction_amount_7d': np.maximum(0, rng.normal(5000, 1000, n_rows)),
+        'is_round_number': (amount % 100 == 0).astype(np.uint8),
+        'is_weekend': (day_of_week >= 5).astype(np.uint8),
+        # Target variable - 1 if anomalous, 0 if normal
+        'is_anomalous': is_anomalous.astype(np.uint8)
+    })
     
-    # Convert to DataFrame
-    df = pd.DataFrame(all_data)
+    # Write it out the same way the ETL export does and read it back like real
+    # data, so Dask reads Arrow buffers with column projection instead of
+    # slicing a pandas copy
+    output_dir = tempfile.mkdtemp(prefix='synthetic_journal_entries_')
+    atexit.register(shutil.rmtree, output_dir, ignore_errors=True)
+    pq.write_to_dataset(table, root_path=output_dir, partition_cols=['entity_id'],
+                        row_group_size=65536)
     
-    # Convert to Dask DataFrame
-    ddf = dd.from_pandas(df, npartitions=10)
+    ddf = dd.read_parquet(output_dir, columns=FEATURE_LIST + [LABEL_COLUMN])
     
     return ddf
 
-def prepare_features(ddf):
+def prepare_features(ddf, feature_list=FEATURE_LIST):
     """Prepare features for XGBoost training"""
-    # Features for anomaly detection
-    feature_list = [
-        'amount',
-        'day_of_week',
-        'day_of_month',
-        'month',
-        'account_balance_delta',
-        'transaction_count_7d',
-        'transaction_amount_7d',
-        'is_round_number',
-        'is_weekend'
-    ]
-    
-    # Create X (features) and y (target)
-    X = ddf[feature_list]
+    # Create X (features) and y (target); float32 halves the bytes shipped
+    # from the Dask workers into the booster
+    X = ddf[feature_list].astype(np.float32)
     
     # For a real model, we would use unsupervised learning or 
     # manually labeled data. For this example, we'll use synthetic labels.
@@ -171,17 +224,22 @@ def prepare_features(ddf):
     # - or manual labels from accountants
     
     # Check if is_anomalous column exists
-    if 'is_anomalous' in ddf.columns:
-        y = ddf['is_anomalous']
+    if LABEL_COLUMN in ddf.columns:
+        y = ddf[LABEL_COLUMN]
     else:
         # If no labels, create synthetic ones (for demonstration)
         # This is just for simulation - in real life, we'd use a proper
         # anomaly detection algorithm to generate labels or use manual ones
-        y = (ddf['is_round_number'] == 1) & (ddf['is_weekend'] == 1)
-        y = y.astype(int)
+        y = ((ddf['is_round_number'] == 1) & (ddf['is_weekend'] == 1)).astype('int8')
     
     return X, y, feature_list
 
+def create_cluster(use_gpu=False):
+    """Start a local Dask cluster, with one worker per GPU when requested"""
+    if use_gpu:
+        return LocalCUDACluster()
+    return LocalCluster()
+
 def train_xgboost_model(X, y):
     """Train XGBoost model using Dask"""
     if not DEPENDENCIES_AVAILABLE:
@@ -191,13 +249,22 @@ def train_xgboost_model(X, y):
         return model
     
     try:
+        # Only move to the GPU when there is enough data to pay for it. For an
+        # unfiltered read the row count comes from the Parquet footers and the
+        # data is only read once, by whichever training path runs below. With
+        # the sample-mode entity filter or row sampling Dask has to scan the
+        # (small) sample to count it, so that data is read twice
+        n_rows = len(X)
+        use_gpu = HAS_DASK_CUDA and n_rows >= GPU_MIN_ROWS
+        
         # XGBoost parameters for anomaly detection
         params = {
             'objective': 'binary:logistic',
             'tree_method': 'hist',  # for faster training
+            'device': 'cuda' if use_gpu else 'cpu',
+            'max_bin': 256,
             'max_depth': 6,
             'learning_rate': 0.1,
-            'n_estimators': 100,
             'subsample': 0.8,
             'colsample_bytree': 0.8,
             'gamma': 1,  # min loss reduction for split
@@ -207,18 +274,22 @@ def train_xgboost_model(X, y):
         }
         
         # Train XGBoost model with Dask
-        print("Training XGBoost model...")
-        
-        # For simulation, we'll just return a mock model
-        # In production, we would use:
-        # model = dask_xgboost.train(client, params, X, y)
+        print(f"Training XGBoost model on {n_rows} rows ({params['device']})...")
         
-        # Simulate model training
-        import time
-        time.sleep(1)  # Simulate training time
-        
-        # Create a mock model for testing
-        model = {"name": "xgboost_anomaly_model", "version": "1.0"}
+        if n_rows <= LOCAL_MAX_ROWS:
+            # Small inputs fit in memory: skip the scheduler and worker
+            # communication and train in-process
+            X_local, y_local = dask.compute(X, y)
+            dtrain = xgb.DMatrix(X_local, label=y_local)
+            model = xgb.train(params, dtrain, num_boost_round=NUM_BOOST_ROUND)
+        else:
+            with create_cluster(use_gpu) as cluster, Client(cluster) as client:
+                # Quantize on the workers so only the compressed bin matrix
+                # reaches the booster, not a float copy of every feature
+                dtrain = dxgb.DaskQuantileDMatrix(client, X, y, max_bin=params['max_bin'])
+                output = dxgb.train(client, params, dtrain, num_boost_round=NUM_BOOST_ROUND)
+            
+            model = output['booster']
         
         print("XGBoost model training complete")
         return model
@@ -237,12 +308,15 @@ def save_model(model, feature_list, output_dir):
         # Save the model
         model_path = os.path.join(output_dir, 'xgb.model')
         
-        # For a real model, we'd use:
-        # joblib.dump(model, model_path)
-        
-        # For simulation, just save the mock model dictionary
-        with open(model_path, 'w') as f:
-            json.dump(model, f)
+        booster = model.get_booster() if hasattr(model, 'get_booster') else model
+        if hasattr(booster, 'save_raw'):
+            # Store the booster as raw UBJSON so it loads natively, without pickle
+            with open(model_path, 'wb') as f:
+                f.write(booster.save_raw(raw_format='ubj'))
+        else:
+            # For simulation, just save the mock model dictionary
+            with open(model_path, 'w') as f:
+                json.dump(model, f)
         
         # Save the feature list
         feature_path = os.path.join(output_dir, 'features.json')
@@ -3,8 +3,44 @@ Startup script for the ML service
 """
 
 import os
-from ml_service import app
+from ml_service import app, warmup
+
+# gunicorn is POSIX-only; fall back to Flask's own server where it is missing
+try:
+    from gunicorn.app.base import BaseApplication
+    HAS_GUNICORN = True
+except ImportError:
+    HAS_GUNICORN = False
+
+if HAS_GUNICORN:
+    class MLServiceApplication(BaseApplication):
+        """Serve the already-imported (and warmed up) Flask app from gunicorn workers"""
+
+        def __init__(self, application, options=None):
+            self.application = application
+            self.options = options or {}
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
 
 if __name__ == "__main__":
     port = int(os.environ.get('PYTHON_SERVICE_PORT', 5001))
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    # Load Prophet up front unless disabled for deployments that don't forecast
+    if os.environ.get('PYTHON_SERVICE_WARMUP', '1') != '0':
+        warmup()
+    if HAS_GUNICORN:
+        # Workers fork from this process after warmup, so they share the loaded Stan model
+        workers = int(os.environ.get('PYTHON_SERVICE_WORKERS', 2 * (os.cpu_count() or 1) + 1))
+        MLServiceApplication(app, {
+            'bind': f'0.0.0.0:{port}',
+            'workers': workers,
+            'preload_app': True,
+            'timeout': 120  # Prophet fits on long series can exceed the 30s default
+        }).run()
+    else:
+        app.run(host='0.0.0.0', port=port, threaded=True)
@@ -0,0 +1,152 @@
+"""
+ML service endpoint tests
+
+Exercise python_service/ml_service.py through Flask's test client.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('flask')
+pd = pytest.importorskip('pandas')
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'python_service'))
+import ml_service  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    ml_service.app.config['TESTING'] = True
+    with ml_service.app.test_client() as client:
+        client.post('/cache/clear')
+        yield client
+
+
+def daily_series(n=60):
+    dates = pd.date_range('2023-01-01', periods=n, freq='D')
+    return [{"ds": d.strftime('%Y-%m-%d'), "y": float(i % 7)} for i, d in enumerate(dates)]
+
+
+def test_health(client):
+    assert client.get('/health').get_json()['status'] == 'ok'
+
+
+def test_anomaly_detection_accepts_dates_and_timestamps(client):
+    data = [
+        {"date": "2022-01-01T00:00:00", "value": 1},
+        {"date": "2022-01-02", "value": 2},
+        {"date": "2022-01-03T10:30:00", "value": 200},
+    ]
+    response = client.post('/analytics/anomaly_detection', json={"data": data, "threshold": 1.0})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['total_anomalies'] == 1
+    assert body['anomalies'] == [{"date": "2022-01-03", "value": 200, "is_anomaly": True}]
+
+
+def test_regression_with_numeric_feature_names(client):
+    pytest.importorskip('sklearn')
+    payload = {
+        "data": {"features": [[1, 2], [3, 4], [5, 7]], "targets": [1, 2, 3], "feature_names": [1, 2]},
+        "prediction_inputs": [[7, 9]]
+    }
+    response = client.post('/analytics/regression', json=payload)
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert set(body['coefficients']) == {"1", "2"}
+    assert isinstance(body['intercept'], float)
+    assert len(body['predictions']) == 1
+
+
+def test_regression_random_forest_skips_scaling(client):
+    pytest.importorskip('sklearn')
+    payload = {
+        "data": {"features": [[1, 2], [3, 4], [5, 7], [8, 1]], "targets": [1, 2, 3, 4]},
+        "model": "random_forest",
+        "n_estimators": 5,
+        "prediction_inputs": [[3, 4]]
+    }
+    response = client.post('/analytics/regression', json=payload)
+
+    assert response.status_code == 200
+    assert len(response.get_json()['feature_importance']) == 2
+
+
+def test_recurring_expense_periods_clamp_to_month_end():
+    start = pd.Timestamp('2023-01-31')
+    periods = ml_service.recurring_expense_periods(start, 1, pd.Timestamp('2023-04-15'))
+
+    # Feb 28 and Mar 31 fall before the cutoff; Apr 30 does not
+    assert [str(p) for p in periods] == ['2023-02', '2023-03']
+
+    quarterly = ml_service.recurring_expense_periods(start, 3, pd.Timestamp('2024-01-31'))
+    assert [str(p) for p in quarterly] == ['2023-04', '2023-07', '2023-10', '2024-01']
+
+
+def test_prophet_forecast_is_cached(client):
+    pytest.importorskip('prophet')
+    payload = {"data": daily_series(), "periods": 5}
+
+    first = client.post('/forecast/prophet', json=payload)
+    second = client.post('/forecast/prophet', json=payload)
+
+    assert first.status_code == second.status_code == 200
+    assert first.get_json()['forecast'] == second.get_json()['forecast']
+    stats = client.get('/cache/stats').get_json()
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 1, 1)
+
+
+def test_prophet_forecast_accepts_dates_and_timestamps(client):
+    pytest.importorskip('prophet')
+    data = daily_series()
+    for point in data[::2]:
+        point['ds'] += 'T00:00:00'
+    response = client.post('/forecast/prophet', json={"data": data, "periods": 2})
+
+    assert response.status_code == 200
+    assert [f['ds'] for f in response.get_json()['forecast']] == ['2023-03-02', '2023-03-03']
+
+
+def test_prophet_forecast_without_uncertainty(client):
+    pytest.importorskip('prophet')
+    payload = {"data": daily_series(), "periods": 3, "uncertainty_samples": 0}
+    forecast = client.post('/forecast/prophet', json=payload).get_json()['forecast']
+
+    assert len(forecast) == 3
+    assert set(forecast[0]) == {"ds", "yhat"}
+
+    # The cached model still produces intervals for a default request
+    del payload['uncertainty_samples']
+    forecast = client.post('/forecast/prophet', json=payload).get_json()['forecast']
+    assert set(forecast[0]) == {"ds", "yhat", "yhat_lower", "yhat_upper"}
+
+
+def test_prophet_batch_reports_errors_per_series(client):
+    pytest.importorskip('prophet')
+    series = [
+        {"data": daily_series(), "periods": 2},
+        {"data": [{"ds": "not a date", "y": 1}]},
+        {"data": daily_series(), "periods": 3},
+    ]
+    response = client.post('/forecast/prophet_batch', json={"series": series})
+
+    assert response.status_code == 200
+    forecasts = response.get_json()['forecasts']
+    assert [f['success'] for f in forecasts] == [True, False, True]
+    assert [len(f['forecast']) for f in (forecasts[0], forecasts[2])] == [2, 3]
+    assert forecasts[1]['error']
+
+
+def test_known_expenses_forecast_accepts_timestamps(client):
+    pytest.importorskip('prophet')
+    history = [{"date": f"2023-{m:02d}-01T00:00:00", "amount": float(m)} for m in range(1, 13)]
+    expenses = [{"name": "Rent", "amount": 100, "date": "2023-03-31", "frequency": "monthly"}]
+    payload = {"historical_data": history, "expenses": expenses, "periods": 2, "frequency": "MS"}
+    response = client.post('/forecast/known_expenses', json=payload)
+
+    assert response.status_code == 200
+    assert [f['ds'] for f in response.get_json()['forecast']] == ['2024-01-01', '2024-02-01']